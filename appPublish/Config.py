@@ -1,13 +1,45 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+
+# The values configparser accepts for booleans
+_BOOLEAN_STATES = {'1': True, 'yes': True, 'true': True, 'on': True,
+                   '0': False, 'no': False, 'false': False, 'off': False}
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    try:
+        return _BOOLEAN_STATES[value.lower()]
+    except KeyError:
+        raise ValueError(f'Not a boolean: {value}')
+
+
+def _known_fields(cls, section: dict) -> dict:
+    names = {field.name for field in fields(cls)}
+    return {key.replace(' ', '_'): value for key, value in section.items() if key.replace(' ', '_') in names}
 
 
 @dataclass
 class AppConfig:
-    workspace: str
     project: str
     scheme: str
     app_id: int
     bundle_id: str
+    workspace: Optional[str] = None
+    uses_encryption: bool = False
+    uses_idfa: bool = False
+
+    @staticmethod
+    def fromDict(section: dict):
+        values = _known_fields(AppConfig, section)
+        if 'app_id' in values:
+            values['app_id'] = int(values['app_id'])
+        for name in ('uses_encryption', 'uses_idfa'):
+            if name in values:
+                values[name] = _parse_bool(values[name])
+        return AppConfig(**values)
 
 
 @dataclass
@@ -15,15 +47,47 @@ class ConnectConfig:
     username: str
     team_name: str
 
+    @staticmethod
+    def fromDict(section: dict):
+        return ConnectConfig(**_known_fields(ConnectConfig, section))
+
 
 @dataclass
 class ScreenshotConfig:
     devices: str
     languages: str
 
+    @staticmethod
+    def fromDict(section: dict):
+        return ScreenshotConfig(**_known_fields(ScreenshotConfig, section))
+
+
+@dataclass
+class BuildConfig:
+    jobs: Optional[int] = None
+
+    @staticmethod
+    def fromDict(section: dict):
+        values = _known_fields(BuildConfig, section)
+        if 'jobs' in values:
+            values['jobs'] = int(values['jobs'])
+        return BuildConfig(**values)
+
 
 @dataclass
 class Config:
     app: AppConfig
     connect: ConnectConfig
-    screenshots: ScreenshotConfig
+    screenshots: Optional[ScreenshotConfig] = None
+    build: BuildConfig = field(default_factory=BuildConfig)
+
+    @staticmethod
+    def fromDict(sections: dict):
+        '''Builds a Config from the sections of app.ini; the screenshots and build sections are optional'''
+        screenshots = sections.get('screenshots')
+        return Config(
+            app=AppConfig.fromDict(sections.get('app', {})),
+            connect=ConnectConfig.fromDict(sections.get('connect', {})),
+            screenshots=ScreenshotConfig.fromDict(screenshots) if screenshots else None,
+            build=BuildConfig.fromDict(sections.get('build', {}))
+        )
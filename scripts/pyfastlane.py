@@ -1,64 +1,290 @@
 #!/usr/bin/env python3
 
-import configparser
 import os
+import re
 import json
-import glob
 import argparse
 import os.path
 import subprocess
 import logging
+import shlex
+import hashlib
+import time
+import tempfile
+import concurrent.futures
+import contextlib
+import threading
+import pathlib
+import shutil
+import types
+import typing
+
+from functools import lru_cache, cached_property
+from datetime import datetime
+from dataclasses import dataclass
 
-import appPublish
-import appstoreconnect
+# pygit2 is optional and imported on first use; without it git is queried through the git command line
+pygit2 = None
+_pygit2_imported = False
 
-from munch import DefaultMunch
-from pprint import pprint
-from functools import *
-from datetime import datetime
-from dataclasses import *
+# Only for annotations; both are imported lazily at runtime, so help works without them
+if typing.TYPE_CHECKING:
+    import appPublish
+    import appstoreconnect
+
+fastlaneCommand = ['bundle', 'exec', 'fastlane']
+
+cacheDir = os.path.join(os.getenv('HOME', ''), '.cache/pyfastlane/')
 
-fastlaneCommand = 'bundle exec fastlane'
+# Bump when parse_ini's output changes, so cached configs from older versions are re-parsed
+iniCacheVersion = 2
+
+# How long App Store Connect responses are reused, in seconds
+appStoreCacheTTL = 60
+
+exportOptionsPlist = b'<?xml version="1.0" encoding="UTF-8"?><!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd"><plist version="1.0"><dict>  <key>method</key><string>app-store</string></dict></plist>'
 
 '''Executes and prints a command'''
 def execute(cmd, silent=True):
-    output_filename = 'command.log'
+    if isinstance(cmd, str):
+        argv = shlex.split(cmd)
+    else:
+        argv = [str(arg) for arg in cmd]
+        cmd = shlex.join(argv)
     logging.info(cmd)
     if silent:
-        cmd += f' > {output_filename} 2>&1'
-    result = os.system(cmd)
-    if result != 0:
+        result = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
+    else:
+        result = subprocess.run(argv, check=False)
+    if result.returncode != 0:
         logging.error(f'Command failed: {cmd}')
-        logging.error(f'Exit code: {result}')
-        logging.error(f'Output is in file {output_filename}')
+        logging.error(f'Exit code: {result.returncode}')
+        if silent:
+            # Only failed commands leave a log behind, under a unique name so parallel runs don't collide
+            fd, output_filename = tempfile.mkstemp(prefix=f'command-{datetime.now():%Y%m%d-%H%M%S}-', suffix='.log', dir='.')
+            with os.fdopen(fd, 'wb') as log:
+                log.write(f'$ {cmd}\n'.encode())
+                log.write(result.stdout)
+            logging.error(f'Output is in file {output_filename}')
         exit(1)
 
 
+def open_git_repository():
+    '''Returns the pygit2 repository containing the working directory, or None to fall back to the git command'''
+    global pygit2, _pygit2_imported
+    if not _pygit2_imported:
+        _pygit2_imported = True
+        try:
+            import pygit2
+        except ImportError:
+            pygit2 = None
+    if pygit2 is None:
+        return None
+    try:
+        repo_path = pygit2.discover_repository(os.getcwd())
+        return pygit2.Repository(repo_path) if repo_path else None
+    except pygit2.GitError as e:
+        logging.debug(f'pygit2 cannot open repository: {e}')
+        return None
+
+
 def git_is_clean():
-    cmd = 'git status --porcelain'
+    repo = open_git_repository()
+    if repo is not None:
+        logging.info('git status (pygit2)')
+        try:
+            status = repo.status(untracked_files='no')
+        except TypeError:
+            # Older pygit2 has no untracked_files option
+            untracked = pygit2.GIT_STATUS_WT_NEW | pygit2.GIT_STATUS_IGNORED
+            status = {path: flags for path, flags in repo.status().items() if not flags & untracked}
+        if len(status) > 0:
+            logging.warning('output:')
+        for path in status:
+            logging.warning(path)
+        return len(status) == 0
+
+    cmd = 'git --no-optional-locks status -uno --porcelain=v2 -z'
     logging.info(cmd)
     try:
-        proc = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE)
-        lines = proc.stdout.readlines()
-        if len(lines) > 0:
-            logging.warning('output:')
-        for line in lines:
-            logging.warning(line.decode().strip())
-        return len(lines) == 0
+        # Any output at all means the tree is dirty, so only the first chunk is needed
+        with subprocess.Popen(cmd.split(), stdout=subprocess.PIPE) as proc:
+            output = proc.stdout.read(4096)
+            if output:
+                proc.kill()
+            elif proc.wait() != 0:
+                # No output can also mean git failed, e.g. outside a repository (exit status 128)
+                logging.error(f'{cmd} failed with exit status {proc.returncode}')
+                exit(1)
     except FileNotFoundError as e:
         logging.error(e)
         exit(1)
 
+    records = [record for record in output.split(b'\0') if record]
+    if len(records) > 0:
+        logging.warning('output:')
+    for record in records:
+        logging.warning(record.decode(errors='replace').strip())
+    return len(records) == 0
+
 
 def git_commit(msg):
-    execute(f'git commit -a -m "{msg}"')
+    execute(['git', 'commit', '-a', '-m', msg])
+
+
+_INI_SECTION = re.compile(r'^\[([^\]]+)\]')
+_INI_OPTION = re.compile(r'^\s*([^=:;#\s][^=:]*?)\s*[=:]\s*(.*)$')
+
+
+def parse_ini(text):
+    '''Parses the simple ini files used by pyfastlane (no interpolation or continuation lines) into a dict of sections.
+    Options may use = or :, and DEFAULT options are merged into every other section, as configparser does.'''
+    sections = {'DEFAULT': {}}
+    section = None
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip() or line.lstrip().startswith(('#', ';')):
+            continue
+        match = _INI_SECTION.match(line)
+        if match:
+            section = sections.setdefault(match.group(1), {})
+            continue
+        match = _INI_OPTION.match(line)
+        if not match or section is None:
+            raise ValueError(f'Cannot parse line {number}: {line!r}')
+        section[match.group(1).lower()] = match.group(2).strip()
+
+    defaults = sections['DEFAULT']
+    return {name: values if name == 'DEFAULT' else {**defaults, **values} for name, values in sections.items()}
+
+
+def read_ini(iniPath):
+    '''Reads an ini file into a dict of sections, reusing a cached copy while the file's mtime and size are unchanged.
+    There is one cache file per ini path, so a changed file replaces its old entry.'''
+    try:
+        stat = os.stat(iniPath)
+    except OSError:
+        return None
+
+    key = [iniCacheVersion, stat.st_mtime_ns, stat.st_size]
+    path_hash = hashlib.blake2b(os.path.abspath(iniPath).encode()).hexdigest()
+    cache_path = os.path.join(cacheDir, f'ini-{path_hash}.json')
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached['key'] == key:
+            return cached['sections']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    try:
+        sections = parse_ini(pathlib.Path(iniPath).read_text())
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=cacheDir, delete=False) as f:
+            json.dump({'key': key, 'sections': sections}, f)
+        os.replace(f.name, cache_path)
+    except OSError as e:
+        logging.debug(f'Cannot write config cache: {e}')
+
+    return sections
+
+
+def app_store_cache_path(endpoint, app_id):
+    return os.path.join(cacheDir, f'{endpoint}-{app_id}.json')
+
+
+def cached_app_store_query(endpoint, app_id, fetch, use_disk_cache=True):
+    '''Returns fetch()'s result, a JSON-compatible summary of an App Store Connect response.
+    A copy on disk is reused for up to appStoreCacheTTL seconds unless use_disk_cache is False.'''
+    cache_path = app_store_cache_path(endpoint, app_id)
+    if use_disk_cache:
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if time.time() - cached['timestamp'] < appStoreCacheTTL:
+                return cached['payload']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    payload = fetch()
+
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=cacheDir, delete=False) as f:
+            json.dump({'timestamp': time.time(), 'payload': payload}, f)
+        os.replace(f.name, cache_path)
+    except (OSError, TypeError, ValueError) as e:
+        logging.debug(f'Cannot cache {endpoint} response: {e}')
+
+    return payload
+
+
+def invalidate_app_store_cache(endpoint, app_id):
+    try:
+        os.remove(app_store_cache_path(endpoint, app_id))
+    except FileNotFoundError:
+        pass
 
 
+marketingVersionCommand = ['agvtool', 'what-marketing-version', '-terse']
+buildNumberCommand = ['agvtool', 'what-version', '-terse']
+
+
+def parse_marketing_version(output):
+    return output.partition('\n')[0].rpartition('=')[2].strip()
+
+
+def parse_build_number(output):
+    return int(output.partition('\n')[0].strip())
+
+
+def has_at_least(names, prefix, n):
+    '''Whether at least n of names start with prefix, stopping as soon as the nth is found'''
+    count = 0
+    for name in names:
+        if name.startswith(prefix):
+            count += 1
+            if count >= n:
+                return True
+    return False
+
+
+def write_if_changed(path, data: bytes):
+    '''Writes data to path unless the file already holds exactly that'''
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return
+    except FileNotFoundError:
+        pass
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def move_directory(src, dst):
+    '''Moves src to dst, merging into dst file-by-file if it already exists'''
+    if not os.path.exists(dst):
+        shutil.move(src, dst)
+        return
+
+    for dirpath, dirnames, filenames in os.walk(src):
+        target_dir = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(target_dir, exist_ok=True)
+        for filename in filenames:
+            os.replace(os.path.join(dirpath, filename), os.path.join(target_dir, filename))
+    shutil.rmtree(src)
+
+
+@lru_cache(maxsize=None)
 def get_filename_body(full_path):
-    return os.path.splitext(os.path.basename(full_path))[0]
+    base = full_path.rpartition(os.sep)[2]
+    return base.rpartition('.')[0] or base
 
 
-@dataclass
+@dataclass(frozen=True, order=True)
 class SemanticVersion:
     major: int
     minor: int
@@ -66,115 +292,173 @@ class SemanticVersion:
 
     @staticmethod
     def fromString(string: str):
-        parts = string.split('.')
-        return SemanticVersion(*parts)
-    
-    def __lt__(self, other: "SemanticVersion") -> bool:
-        if self.major < other.major:
-            return True
-        if self.major > other.major:
-            return False
-        
-        if self.minor < other.minor:
-            return True
-        if self.major > other.major:
-            return False
-        
-        return self.patch < other.patch
-    
-    def __eq__(self, other: "SemanticVersion") -> bool:
-        return self.major == other.major and self.minor == other.minor and self.patch == other.patch
-    
-    def __gt__(self, other: "SemanticVersion") -> bool:
-        return not (self < other or self == other)
+        parts = [int(part) for part in string.split('.', 2)]
+        # "1.2" is a valid marketing version; treat missing components as 0
+        return SemanticVersion(*parts, *[0] * (3 - len(parts)))
 
-    def __le__(self, other: "SemanticVersion") -> bool:
-        return self < other or self == other
-    
     def __str__(self):
         return f'{self.major}.{self.minor}.{self.patch}'
 
 class App:
-    config: appPublish.Config
-    session: appstoreconnect.Session
+    config: 'appPublish.Config'
+    session: 'appstoreconnect.Session'
+
+    # Languages that snapshot must be given under a different name
+    LANGUAGE_ALIASES: dict[str, str] = {'no': 'no-NO'}
+
+    # Maps each action name to the name of the method that performs it
+    ACTIONS: dict[str, str] = {
+        'versions': 'show_version_information',
+        'version_check': 'version_check',
+        'build': 'build_ipa',
+        'upload_binary': 'upload_binary',
+        'upload_metadata': 'upload_metadata',
+        'upload_screenshots': 'upload_screenshots',
+        'replace_screenshots': 'replace_screenshots',
+        'upload_listing': 'upload_listing',
+        'testflight': 'testflight',
+        'snapshot': 'snapshot',
+        'help': 'help'
+    }
 
     def __init__(self, path: str):
         self.path = path
-        parser = configparser.ConfigParser()
-        iniPath = os.path.join(path, 'app.ini')
-        successfullyReadFilenames = parser.read(iniPath)
-        if len(successfullyReadFilenames) < 1:
+        self._cached_version = None
+        self._cached_build = None
+        self._app_store_responses = {}
+        self._session = None
+        self._session_lock = threading.Lock()
+
+
+    @cached_property
+    def config(self) -> 'appPublish.Config':
+        '''Reads app.ini on first use, so actions like help never touch it'''
+        import appPublish
+
+        iniPath = os.path.join(self.path, 'app.ini')
+        try:
+            sections = read_ini(iniPath)
+        except ValueError as e:
+            logging.error(f'Invalid configuration in {iniPath}: {e}')
+            exit(1)
+        if sections is None:
             logging.error(f'Cannot read: {iniPath}')
             exit(1)
 
-        config: appPublish.Config = DefaultMunch.fromDict(dict(parser))
-        self.config = config
+        try:
+            return appPublish.Config.fromDict(sections)
+        except (TypeError, ValueError) as e:
+            logging.error(f'Invalid configuration in {iniPath}: {e}')
+            exit(1)
 
-        self.config.project_dir = os.path.dirname(self.config.app.project)
-        self.temp_dir_name = get_filename_body(self.config.app.project) + '-' + self.config.app.scheme
 
-        try:
-            self.screenshot_languages = [x.strip() for x in config.screenshots.languages.split(',')]
-            self.screenshot_devices = [x.strip() for x in config.screenshots.devices.split(',')]
-        except KeyError:
-            self.screenshot_languages = []
-            self.screenshot_devices = []
-
-        submission_information_string = json.dumps({
-            'export_compliance_uses_encryption': self.config.app.uses_encryption or False,
-            'add_id_info_uses_idfa': self.config.app.uses_idfa or False
+    @cached_property
+    def project_dir(self) -> str:
+        return os.path.dirname(self.config.app.project)
+
+
+    @cached_property
+    def temp_dir_name(self) -> str:
+        return get_filename_body(self.config.app.project) + '-' + self.config.app.scheme
+
+
+    @cached_property
+    def screenshot_languages(self) -> list[str]:
+        if self.config.screenshots is None:
+            return []
+        return [x.strip() for x in self.config.screenshots.languages.split(',')]
+
+
+    @cached_property
+    def screenshot_devices(self) -> list[str]:
+        if self.config.screenshots is None:
+            return []
+        return [x.strip() for x in self.config.screenshots.devices.split(',')]
+
+
+    @property
+    def session(self):
+        '''The App Store Connect session, created on first use and shared by the query threads'''
+        with self._session_lock:
+            if self._session is None:
+                import appstoreconnect
+                self._session = appstoreconnect.Session()
+            return self._session
+
+
+    @cached_property
+    def submission_information_string(self) -> str:
+        return json.dumps({
+            'export_compliance_uses_encryption': self.config.app.uses_encryption,
+            'add_id_info_uses_idfa': self.config.app.uses_idfa
         })
 
-        deliver_options = [
+
+    @cached_property
+    def deliver_options(self) -> tuple[str, ...]:
+        return (
             '--force',
-            '--run_precheck_before_submit false',
-            f'--username {self.config.connect.username}',
-            f'--team_name "{self.config.connect.team_name}"',
-            f'--submission_information \'{submission_information_string}\'',
-            f'--metadata_path \'{self.path}/fastlane/metadata\'',
-            f'--app_identifier {self.config.app.bundle_id}'
-        ]
+            '--run_precheck_before_submit', 'false',
+            '--username', self.config.connect.username,
+            '--team_name', self.config.connect.team_name,
+            '--submission_information', self.submission_information_string,
+            '--metadata_path', f'{self.path}/fastlane/metadata',
+            '--app_identifier', self.config.app.bundle_id
+        )
+
 
-        self.deliver_options = ' '.join(deliver_options)
+    def deliver_argv(self, extra) -> list[str]:
+        '''The full fastlane deliver command line with the app's options followed by extra'''
+        return [*fastlaneCommand, 'deliver', *self.deliver_options, *extra]
 
-        self.actions = {
-            'versions': self.show_version_information,
-            'version_check': self.version_check,
-            'build': self.build_ipa,
-            'upload_binary': self.upload_binary,
-            'upload_metadata': self.upload_metadata,
-            'upload_screenshots': self.upload_screenshots,
-            'replace_screenshots': self.replace_screenshots,
-            'testflight': self.testflight,
-            'snapshot': self.snapshot,
-            'help': self.help
-        }
 
-        self.session = appstoreconnect.Session()
+    @cached_property
+    def workspace_args(self) -> list[str]:
+        '''The xcodebuild -workspace arguments, or none for a bare project'''
+        if self.config.app.workspace is not None:
+            return ['-workspace', self.config.app.workspace]
+        else:
+            return []
 
 
     def doAction(self, action_name):
-        try:
-            action = self.actions[action_name]
-            action()
-        except KeyError:
+        method_name = self.ACTIONS.get(action_name)
+        if method_name is None:
             logging.error(f'Unknown action "{action_name}"')
             self.help()
+        else:
+            getattr(self, method_name)()
 
     def _get_version_number(self):
-        cmd = 'agvtool what-marketing-version -terse'.split()
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        for lineBytes in proc.stdout:
-            line = lineBytes.decode()
-            version_string = line[line.rfind('=') + 1:].strip()
-            return version_string
+        '''The project's marketing version, read once until agvtool changes it'''
+        if self._cached_version is None:
+            self._cached_version = parse_marketing_version(subprocess.check_output(marketingVersionCommand, text=True))
+        return self._cached_version
 
     def getProjectBuildNumber(self) -> int:
-        cmd = 'agvtool what-version -terse'.split()
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        for lineBytes in proc.stdout:
-            versionNumber = int(lineBytes.decode().strip())
-            return versionNumber
+        '''The project's build number, read once until agvtool changes it'''
+        if self._cached_build is None:
+            self._cached_build = parse_build_number(subprocess.check_output(buildNumberCommand, text=True))
+        return self._cached_build
+
+    def _prefetch_project_versions(self):
+        '''Runs the agvtool queries that aren't cached yet side by side instead of one after the other'''
+        # Every started child is waited on and its pipe closed, even if another fails to start or exits non-zero
+        with contextlib.ExitStack() as stack:
+            procs = {}
+            if self._cached_version is None:
+                procs['version'] = stack.enter_context(subprocess.Popen(marketingVersionCommand, stdout=subprocess.PIPE, text=True))
+            if self._cached_build is None:
+                procs['build'] = stack.enter_context(subprocess.Popen(buildNumberCommand, stdout=subprocess.PIPE, text=True))
+            outputs = {name: proc.communicate()[0] for name, proc in procs.items()}
+
+        for name, proc in procs.items():
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args, outputs[name])
+            if name == 'version':
+                self._cached_version = parse_marketing_version(outputs[name])
+            else:
+                self._cached_build = parse_build_number(outputs[name])
 
 
     def ensure_git_clean(self):
@@ -185,23 +469,50 @@ class App:
 
     def tag_commit(self, tag_name: str):
         logging.info(f'Tagging commit as {tag_name}')
-        execute(f'git tag -f {tag_name}')
+        repo = open_git_repository()
+        if repo is not None:
+            repo.create_reference(f'refs/tags/{tag_name}', repo.head.target, force=True)
+        else:
+            execute(['git', 'tag', '-f', tag_name])
 
 
-    def getLatestAppStoreBuild(self):
-        builds = self.session.get_builds(self.config.app.app_id)
-        try:
-            return max(builds, key=lambda b: b.attributes.uploadedDate)
-        except:
-            return None
+    def _latest_app_store_record(self, endpoint: str, date_field: str, fields: tuple, use_disk_cache=True):
+        '''The newest record from the named Session method for this app, or None.
+        Only the given attribute fields are kept, so the result can be cached as JSON.'''
+        app_id = self.config.app.app_id
 
+        def fetch():
+            records = getattr(self.session, endpoint)(app_id)
+            latest = max(records or (), key=lambda record: getattr(record.attributes, date_field), default=None)
+            return None if latest is None else {name: getattr(latest.attributes, name) for name in fields}
+
+        if not use_disk_cache or endpoint not in self._app_store_responses:
+            self._app_store_responses[endpoint] = cached_app_store_query(endpoint, app_id, fetch, use_disk_cache)
+        attributes = self._app_store_responses[endpoint]
+        return None if attributes is None else types.SimpleNamespace(attributes=types.SimpleNamespace(**attributes))
+
+
+    def _invalidate_app_store_queries(self):
+        self._app_store_responses.clear()
+        for endpoint in ('get_builds', 'get_appStoreVersions'):
+            invalidate_app_store_cache(endpoint, self.config.app.app_id)
+
+
+    def getLatestAppStoreBuild(self, use_disk_cache=True):
+        return self._latest_app_store_record('get_builds', 'uploadedDate', ('version', 'uploadedDate'), use_disk_cache)
+
+
+    def getLatestAppStoreVersion(self, use_disk_cache=True):
+        return self._latest_app_store_record('get_appStoreVersions', 'createdDate', ('versionString', 'createdDate', 'appStoreState'), use_disk_cache)
 
-    def getLatestAppStoreVersion(self):
-        versions = self.session.get_appStoreVersions(self.config.app.app_id)
-        try:
-            return max(versions, key=lambda version: version.attributes.createdDate)
-        except:
-            return None
+
+    def _latest_app_store_records(self, use_disk_cache=True):
+        '''Fetches the latest build and App Store version concurrently, reading the project's versions meanwhile'''
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            latest_build_future = executor.submit(self.getLatestAppStoreBuild, use_disk_cache)
+            latest_version_future = executor.submit(self.getLatestAppStoreVersion, use_disk_cache)
+            self._prefetch_project_versions()
+            return latest_build_future.result(), latest_version_future.result()
 
 
     def show_version_information(self):
@@ -210,14 +521,12 @@ class App:
             DATE_FORMAT = '%Y-%m-%d %H:%M:%S %Z'
             return datetime.fromisoformat(isoString).astimezone().strftime(DATE_FORMAT)
 
-        session = appstoreconnect.Session()
-        latest_build: appstoreconnect.Build = None
+        latest_build, latest_version = self._latest_app_store_records()
 
         print(f'{"":15s} {"Version":12s} {"Date":25s} {"Build":12s} {"Date":25s}')
 
         print(f'{"Project":15s} {self._get_version_number():12s} {"":25s} {self.getProjectBuildNumber():12d}')
 
-        latest_build = self.getLatestAppStoreBuild()
         if latest_build:
             app_store_build = latest_build.attributes.version
             app_store_build_date = localTimeString(latest_build.attributes.uploadedDate)
@@ -225,7 +534,6 @@ class App:
             app_store_build = 'None'
             app_store_build_date = ''
 
-        latest_version = self.getLatestAppStoreVersion()
         if latest_version:
             app_store_version = latest_version.attributes.versionString
             app_store_version_date = localTimeString(latest_version.attributes.createdDate)
@@ -238,21 +546,23 @@ class App:
 
     def version_check(self):
         '''Checks to make sure the project's version settings are up-to-date'''
+        # The next build number is chosen from this, so always ask App Store Connect rather than the disk cache
+        latestAppStoreBuild, latestAppStoreVersion = self._latest_app_store_records(use_disk_cache=False)
+
         logging.info('Checking App Store build...')
-        latestAppStoreBuild = self.getLatestAppStoreBuild()
         projectBuildNumber = self.getProjectBuildNumber()
 
         if latestAppStoreBuild:
             latestAppStoreBuildNumber = int(latestAppStoreBuild.attributes.version)
             newBuildNumber = max(projectBuildNumber, latestAppStoreBuildNumber + 1)
             logging.info(f'App Store build is {latestAppStoreBuildNumber}, setting build number to {newBuildNumber}')
-            execute(f'agvtool new-version -all {newBuildNumber}')
+            execute(['agvtool', 'new-version', '-all', newBuildNumber])
+            self._cached_build = newBuildNumber
             git_commit(f'Bump to build {newBuildNumber}')
         else:
             logging.warning('No builds on App Store!')
 
         logging.info('Checking App Store version...')
-        latestAppStoreVersion = self.getLatestAppStoreVersion()
         if latestAppStoreVersion:
             latestSemanticVersion = SemanticVersion.fromString(latestAppStoreVersion.attributes.versionString)
             projectSemanticVersion = SemanticVersion.fromString(self._get_version_number())
@@ -269,7 +579,8 @@ class App:
 
             if needNewVersion:
                 newVersion = input('Enter new version: ')
-                execute(f'agvtool new-marketing-version {newVersion}')
+                execute(['agvtool', 'new-marketing-version', newVersion])
+                self._cached_version = None
                 git_commit(f'Bump to version {newVersion}')
             else:
                 logging.info('Versions good.')
@@ -280,20 +591,29 @@ class App:
 
     def build_ipa(self):
         '''Builds the .ipa file'''
-        if self.config.app.workspace is not None:
-            workspaceParam = f'-workspace {self.config.app.workspace}'
-        else:
-            workspaceParam = ''
-
         derived_data_dir = './build/'
         os.makedirs(derived_data_dir, exist_ok=True)
 
-        # Builds the app into an archive
-        execute(f'xcodebuild {workspaceParam} -scheme {self.config.app.scheme} -destination \'generic/platform=iOS\' -archivePath ./build/{self.config.app.scheme}.xcarchive archive')
+        # Builds the app into an archive, compiling with as many concurrent tasks as there are cores
+        jobs = self.config.build.jobs or os.cpu_count() or 1
+        execute([
+            'xcodebuild', *self.workspace_args,
+            '-scheme', self.config.app.scheme,
+            '-destination', 'generic/platform=iOS',
+            '-archivePath', f'./build/{self.config.app.scheme}.xcarchive',
+            '-parallelizeTargets', '-jobs', jobs,
+            f'-IDEBuildOperationMaxNumberOfConcurrentCompileTasks={jobs}',
+            'archive'
+        ])
 
         # Exports the archive according to the export options specified by the plist
-        open('./build/ExportOptions.plist', 'w').write('<?xml version="1.0" encoding="UTF-8"?><!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd"><plist version="1.0"><dict>  <key>method</key><string>app-store</string></dict></plist>')
-        execute(f'xcodebuild -exportArchive -archivePath ./build/{self.config.app.scheme}.xcarchive -exportPath ./build/ -exportOptionsPlist ./build/ExportOptions.plist')
+        write_if_changed('./build/ExportOptions.plist', exportOptionsPlist)
+        execute([
+            'xcodebuild', '-exportArchive',
+            '-archivePath', f'./build/{self.config.app.scheme}.xcarchive',
+            '-exportPath', './build/',
+            '-exportOptionsPlist', './build/ExportOptions.plist'
+        ])
 
     
     def ipaPath(self):
@@ -305,7 +625,7 @@ class App:
         # xcrun altool --upload-package  file_path --type  {macos | ios | appletvos} --asc-public-id  id 
         # --apple-id id --bundle-version version --bundle-short-version-string string --bundle-id id {-u  username [-p  password] | --apiKey api_key --apiIssuer  issuer_id}
         params = [
-            'xcrun altool',
+            'xcrun', 'altool',
             '--upload-package', self.ipaPath(),
             '--type', 'ios',
             '--asc-public-id', '69a6de6f-82da-47e3-e053-5b8c7c11a4d1',
@@ -317,28 +637,35 @@ class App:
             '--apiIssuer', '69a6de6f-82da-47e3-e053-5b8c7c11a4d1'
         ]
 
-        commandString = ' '.join(params)
+        execute(params)
+        self._invalidate_app_store_queries()
+        self.tag_commit(self._get_version_number())
+
 
-        execute(commandString)
+    def _deliver(self, *options, silent=True):
+        '''Runs fastlane deliver with the app's options plus the given ones, then tags the commit'''
+        execute(self.deliver_argv(['--skip_binary_upload', *options]), silent=silent)
         self.tag_commit(self._get_version_number())
 
 
     def upload_metadata(self):
         '''Uploads the metadata to App Store Connect'''
-        execute(f'{fastlaneCommand} deliver {self.deliver_options} --skip_binary_upload --skip_screenshots', silent=False)
-        self.tag_commit(self._get_version_number())
+        self._deliver('--skip_screenshots', silent=False)
 
 
     def upload_screenshots(self):
         '''Uploads screenshots to App Store Connect'''
-        execute(f'{fastlaneCommand} deliver {self.deliver_options} --skip_binary_upload --skip_metadata --force')
-        self.tag_commit(self._get_version_number())
+        self._deliver('--skip_metadata')
 
 
     def replace_screenshots(self):
         '''Replace all screenshots to App Store Connect'''
-        execute(f'{fastlaneCommand} deliver {self.deliver_options} --skip_binary_upload --skip_metadata --force --overwrite_screenshots')
-        self.tag_commit(self._get_version_number())
+        self._deliver('--skip_metadata', '--overwrite_screenshots')
+
+
+    def upload_listing(self):
+        '''Uploads the metadata and screenshots to App Store Connect in a single fastlane run'''
+        self._deliver(silent=False)
 
 
     def testflight(self):
@@ -353,48 +680,70 @@ class App:
         '''Capture screenshots using Snapshot'''
         deviceList = ",".join(self.screenshot_devices)
 
-        derived_data_dir = os.path.join(os.getenv('HOME'), '.cache/pyfastlane/', self.temp_dir_name)
+        derived_data_dir = os.path.join(cacheDir, self.temp_dir_name)
         os.makedirs(derived_data_dir, exist_ok=True)
 
         # Build the app bundle once
         device = self.screenshot_devices[0]
 
+        execute([
+            'xcodebuild', *self.workspace_args,
+            '-scheme', self.config.app.scheme,
+            '-derivedDataPath', derived_data_dir,
+            '-destination', f'platform=iOS Simulator,name={device},OS=14.2',
+            'FASTLANE_SNAPSHOT=YES', 'FASTLANE_LANGUAGE=en-US',
+            'build-for-testing'
+        ])
+
+        # List each language's screenshots once, then check every device against that listing
+        existing = {}
+        for language in self.screenshot_languages:
+            try:
+                with os.scandir(f'fastlane/screenshots/{language}') as entries:
+                    existing[language] = [entry.name for entry in entries]
+            except FileNotFoundError:
+                existing[language] = []
+
         if self.config.app.workspace is not None:
-            workspaceParam = f'-workspace {self.config.app.workspace}'
+            workspace_args = [f'workspace:{self.config.app.workspace}']
         else:
-            workspaceParam = ''
-
-        execute(f'xcodebuild {workspaceParam} -scheme "{self.config.app.scheme}" -derivedDataPath {derived_data_dir} -destination "platform=iOS Simulator,name={device},OS=14.2" FASTLANE_SNAPSHOT=YES FASTLANE_LANGUAGE=en-US build-for-testing')
+            workspace_args = []
 
-        for device in self.screenshot_devices:
-            for language in self.screenshot_languages:
+        pending = {}
+        for language in self.screenshot_languages:
+            for device in self.screenshot_devices:
                 # Skip if we already have >4 screenshots in this directory
-                if len(glob.glob(f'{fastlaneCommand}/screenshots/{language}/{device}*')) > 4:
+                if has_at_least(existing[language], device, 5):
                     logging.warning(f'Skipped {device:40}    {language:6}')
                     continue
 
-                if language == 'no':
-                    language = 'no-NO'
+                pending.setdefault(self.LANGUAGE_ALIASES.get(language, language), []).append(device)
 
-                if self.config.app.workspace is not None:
-                    workspaceParam = f'workspace:"{self.config.app.workspace}"'
-                else:
-                    workspaceParam = ''
+        # fastlane keeps the current language in one per-user file and clears test results under the
+        # derived data path, so languages run one at a time; each run snapshots all its devices at once
+        for language, devices in pending.items():
+            execute([
+                'nice', '-n', '20', 'fastlane', 'run', 'snapshot', *workspace_args,
+                f'scheme:{self.config.app.scheme}',
+                f'devices:{",".join(devices)}',
+                f'languages:{language}',
+                'concurrent_simulators:true',
+                'test_without_building:true',
+                f'derived_data_path:{derived_data_dir}'
+            ])
 
-                execute(f'nice -n 20 fastlane run snapshot {workspaceParam} scheme:"{self.config.app.scheme}" devices:"{device}" languages:"{language}" test_without_building:true derived_data_path:"{derived_data_dir}"')
+        # Sigh, we need to move aliased screenshots (e.g. "no-NO") back to the language's own directory
+        for language, alias in self.LANGUAGE_ALIASES.items():
+            if alias in pending:
+                move_directory(f'fastlane/screenshots/{alias}', f'fastlane/screenshots/{language}')
 
-                # Sigh, we need to move "no-NO" to "no"
-                if language == 'no-NO':
-                    execute('rsync -r fastlane/screenshots/no-NO fastlane/screenshots/no')
-                    execute('rm -rf fastlane/screenshots/no-NO')
 
-
-    def help(self):
+    @staticmethod
+    def help():
         '''Shows available actions'''
         print('Available actions:')
-        actions = self.actions
-        for action_name in actions:
-            print(f'{action_name:25}: {actions[action_name].__doc__}')
+        for action_name, method_name in App.ACTIONS.items():
+            print(f'{action_name:25}: {getattr(App, method_name).__doc__}')
 
 
 # Main
@@ -413,11 +762,16 @@ if __name__ == '__main__':
     else:
         logging.basicConfig(level=logging.INFO, format=log_format)
 
-    app = App(args.path)
-
     actions = args.actions
     if len(actions) == 0:
         actions  = ['help']
 
+    # Help needs nothing from the app, so don't even create one
+    if actions == ['help']:
+        App.help()
+        exit(0)
+
+    app = App(args.path)
+
     for action in actions:
         app.doAction(action)
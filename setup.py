@@ -13,4 +13,7 @@ setup(name='pyfastlane',
       packages=['appPublish'],
       install_requires=[
       ],
+      extras_require={
+            'pygit2': ['pygit2'],
+      },
       zip_safe=False)